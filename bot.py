@@ -1,14 +1,32 @@
 # bot.py — Legislación PBA (v3 conversacional con intenciones)
-import os, logging, re
-import pandas as pd
-from typing import Dict, Any, Tuple
+import os, logging, re, asyncio, functools
+import numpy as np, pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-from saij_core import load_latest_dataframe, search as saij_search, parse_nl_query, compare_rows
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+from saij_core import get_df, search as saij_search, parse_nl_query, compare_rows
 
 logging.basicConfig(level=logging.INFO)
 TOKEN = (os.getenv("TELEGRAM_BOT_TOKEN") or "").strip()
+# con URL pública se reciben updates por webhook (Render expone RENDER_EXTERNAL_URL y PORT);
+# sin ella, long polling como antes
+WEBHOOK_URL = (os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL") or "").strip().rstrip("/")
+PORT = int(os.getenv("PORT") or 8443)
+# opcional: servidor telegram-bot-api propio, p.ej. http://127.0.0.1:8081
+BOT_API_URL = (os.getenv("TELEGRAM_API_URL") or "").strip().rstrip("/")
+# cada cuánto se vuelve a mirar si hay una versión nueva de la base (segundos)
+DF_REFRESH = int(os.getenv("DF_REFRESH_SECS") or 86400)
 DF: pd.DataFrame | None = None
+DF_READY = asyncio.Event()   # se marca cuando DF terminó de cargarse en segundo plano
+_BG_TASKS: List[asyncio.Task] = []   # carga y recarga de la base (ver _post_init)
+# búsquedas fuera del loop: un chat lento no frena a los demás; el lock por chat
+# conserva el orden de los mensajes dentro de cada conversación. Cada entrada lleva
+# cuántos mensajes del chat lo usan y se borra cuando no queda ninguno
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+_CHAT_LOCKS: Dict[int, List] = {}   # chat_id -> [lock, mensajes en curso o en espera]
+
+_RE_NUMS = re.compile(r"\d{4,6}")   # números de norma en "compará 14528 con 15464"
 
 HELP = (
     "🧠 *Asistente de Legislación PBA*\n"
@@ -17,10 +35,14 @@ HELP = (
     "Comandos: /help /status /limite 15 /vigente on|off /detalle N /comparar N M\n"
 )
 
-def _format_page(df: pd.DataFrame, cols: Dict[str,str], offset=0, page=5) -> Tuple[str, InlineKeyboardMarkup | None]:
-    items = df.iloc[offset:offset+page]
+def _last_results(context) -> Tuple[pd.DataFrame | None, np.ndarray | None]:
+    # por usuario sólo se guardan las filas (posiciones en la base), no una copia del resultado
+    return context.user_data.get("last_results") or (None, None)
+
+def _format_page(base: pd.DataFrame, rows: np.ndarray, cols: Dict[str,str], offset=0, page=5) -> Tuple[str, InlineKeyboardMarkup | None]:
+    items = base.take(rows[offset:offset+page])
     lines=[]
-    for idx, row in items.iterrows():
+    for idx, (_, row) in enumerate(items.iterrows(), start=offset):
         partes=[]
         if cols.get("tipo") and cols["tipo"] in row and str(row[cols["tipo"]]): partes.append(str(row[cols["tipo"]])[:60])
         if cols.get("numero") and cols["numero"] in row and str(row[cols["numero"]]): partes.append(f"N° {row[cols['numero']]}")
@@ -34,10 +56,48 @@ def _format_page(df: pd.DataFrame, cols: Dict[str,str], offset=0, page=5) -> Tup
     text="\n\n".join(lines) if lines else "⚠️ Sin resultados."
     btns=[]
     if offset>0: btns.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"page:{max(0,offset-page)}"))
-    if offset+page < len(df): btns.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"page:{offset+page}"))
+    if offset+page < len(rows): btns.append(InlineKeyboardButton("Siguiente ➡️", callback_data=f"page:{offset+page}"))
     kb = InlineKeyboardMarkup([btns]) if btns else None
     return text, kb
 
+# -------- carga de la base --------
+async def _bootstrap_df():
+    # descarga + parseo en un hilo: el loop sigue atendiendo mientras tanto
+    global DF
+    while DF is None:
+        try:
+            DF = await asyncio.to_thread(get_df, DF_REFRESH)
+        except Exception:
+            logging.exception("No se pudo cargar la base SAIJ PBA; reintento en 60 s")
+            await asyncio.sleep(60)
+    DF_READY.set()
+
+async def _refresh_df():
+    # recarga periódica en un hilo; las consultas siguen con la base anterior hasta el cambio
+    # (y los resultados guardados por usuario conservan la base con la que se hicieron)
+    global DF
+    await DF_READY.wait()
+    while True:
+        await asyncio.sleep(DF_REFRESH)
+        try:
+            DF = await asyncio.to_thread(get_df, 0)
+        except Exception:
+            logging.exception("No se pudo actualizar la base SAIJ PBA; sigue la anterior")
+
+async def _post_init(app):
+    # post_init corre antes de que la app arranque: tareas del loop, guardadas para
+    # cancelarlas al apagar (la de recarga no termina nunca por sí sola)
+    loop = asyncio.get_running_loop()
+    _BG_TASKS[:] = [loop.create_task(_bootstrap_df()), loop.create_task(_refresh_df())]
+
+async def _post_shutdown(app):
+    for t in _BG_TASKS: t.cancel()
+    await asyncio.gather(*_BG_TASKS, return_exceptions=True)
+    _BG_TASKS.clear()
+
+async def _run(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
 # -------- commands --------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_markdown_v2("👋 Bienvenido.\n\n"+HELP)
@@ -69,12 +129,12 @@ async def set_vigente(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def detalle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         i = int((context.args or [""])[0]) - 1
-        df: pd.DataFrame = context.user_data.get("last_results")
+        base, rows = _last_results(context)
         cols = context.user_data.get("last_cols", {})
-        if df is None or i<0 or i>=len(df):
+        if base is None or i<0 or i>=len(rows):
             await update.message.reply_text("No tengo resultados en memoria o índice inválido.")
             return
-        row = df.iloc[i]
+        row = base.iloc[rows[i]]
         partes=[]
         for k in ("tipo","numero","anio","fecha","estado"):
             c = cols.get(k)
@@ -91,22 +151,34 @@ async def comparar_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         a = int((context.args or [""])[0]) - 1
         b = int((context.args or ["",""])[1]) - 1
-        df: pd.DataFrame = context.user_data.get("last_results")
+        base, rows = _last_results(context)
         cols = context.user_data.get("last_cols", {})
-        if df is None: 
+        if base is None: 
             await update.message.reply_text("No tengo resultados en memoria. Hacé primero una búsqueda.")
             return
-        txt = compare_rows(df.iloc[a], df.iloc[b], cols)
+        txt = compare_rows(base.iloc[rows[a]], base.iloc[rows[b]], cols)
         await update.message.reply_markdown(txt, disable_web_page_preview=False)
     except Exception:
         await update.message.reply_text("Usá: /comparar N M (ej: /comparar 1 3)")
 
 # -------- main handler (intenciones) --------
 async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global DF
-    if DF is None:
+    cid = update.effective_chat.id
+    ent = _CHAT_LOCKS.setdefault(cid, [asyncio.Lock(), 0]); ent[1] += 1
+    try:
+        async with ent[0]:
+            await _handle(update, context)
+    finally:
+        ent[1] -= 1
+        if not ent[1]: del _CHAT_LOCKS[cid]   # un solo hilo (el loop): nadie lo tomó en el medio
+
+async def _handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not DF_READY.is_set():
         await update.message.reply_text("⏳ Cargando base SAIJ PBA (primera vez). Puede tardar 1–2 minutos…")
-        DF = load_latest_dataframe()
+        await DF_READY.wait()
+    # la base se toma una vez: _refresh_df puede cambiar DF mientras se espera la búsqueda,
+    # y las filas del resultado sólo valen para la base sobre la que se calcularon
+    base = DF
 
     raw = update.message.text or ""
     intent = parse_nl_query(raw)
@@ -119,12 +191,12 @@ async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if intent.get("limit") is None: intent["limit"]=10
 
     # intención: comparar por números explícitos (p.ej. "compará 14528 con 15464")
-    if intent["action"] == "compare" and re.findall(r"\d{4,6}", raw):
-        nums = re.findall(r"\d{4,6}", raw)
+    nums = _RE_NUMS.findall(raw) if intent["action"] == "compare" else []
+    if nums:
         # buscamos cada número por separado y comparamos el mejor match de cada uno
         found=[]
         for n in nums[:2]:
-            df1, cols1 = saij_search(DF, numero=n, limit=1)
+            df1, cols1 = await _run(saij_search, base, numero=n, limit=1)
             if df1.empty: continue
             found.append((df1.iloc[0], cols1))
         if len(found)==2:
@@ -134,8 +206,8 @@ async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
     # por defecto, búsqueda
-    df, cols = saij_search(
-        DF, query=intent.get("q"), tipo=intent.get("tipo"), vigente=intent.get("vigente"),
+    df, cols = await _run(saij_search,
+        base, query=intent.get("q"), tipo=intent.get("tipo"), vigente=intent.get("vigente"),
         numero=intent.get("numero"), anio=intent.get("anio"),
         anio_desde=intent.get("anio_desde"), anio_hasta=intent.get("anio_hasta"),
         limit=max(10, intent["limit"])
@@ -145,32 +217,36 @@ async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ Sin resultados. Probá con menos palabras o quitá filtros /vigente off.")
         return
 
-    context.user_data["last_results"]=df.reset_index(drop=True)
+    # el índice del resultado son las posiciones en `base`; se guarda también la base para que
+    # una recarga posterior no desalinee las filas
+    rows = df.index.to_numpy(dtype=np.int32)
+    context.user_data["last_results"]=(base, rows)
     context.user_data["last_cols"]=cols
     context.user_data["offset"]=0
 
-    text, kb = _format_page(context.user_data["last_results"], cols, offset=0, page=5)
+    text, kb = _format_page(base, rows, cols, offset=0, page=5)
     await update.message.reply_markdown(text, reply_markup=kb, disable_web_page_preview=False)
 
 async def page_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query; await q.answer()
     if not (q.data or "").startswith("page:"): return
     off = int(q.data.split(":",1)[1])
-    df: pd.DataFrame = context.user_data.get("last_results")
+    base, rows = _last_results(context)
     cols = context.user_data.get("last_cols", {})
-    if df is None:
+    if base is None:
         await q.edit_message_text("No hay resultados. Enviá una consulta nueva.")
         return
-    text, kb = _format_page(df, cols, offset=off, page=5)
+    text, kb = _format_page(base, rows, cols, offset=off, page=5)
     context.user_data["offset"]=off
     try:
         await q.edit_message_text(text, reply_markup=kb, parse_mode="Markdown", disable_web_page_preview=False)
     except Exception:
         await q.message.reply_markdown(text, reply_markup=kb, disable_web_page_preview=False)
 
-def main():
-    if not TOKEN: raise SystemExit("Falta TELEGRAM_BOT_TOKEN")
-    app = ApplicationBuilder().token(TOKEN).build()
+def build_app(token: str) -> Application:
+    builder = ApplicationBuilder().token(token).post_init(_post_init).post_shutdown(_post_shutdown).concurrent_updates(True)
+    if BOT_API_URL: builder = builder.base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+    app = builder.build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("status", status))
@@ -180,7 +256,15 @@ def main():
     app.add_handler(CommandHandler("comparar", comparar_cmd))
     app.add_handler(CallbackQueryHandler(page_cb))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle))
-    app.run_polling()
+    return app
+
+def main():
+    if not TOKEN: raise SystemExit("Falta TELEGRAM_BOT_TOKEN")
+    app = build_app(TOKEN)
+    if WEBHOOK_URL:
+        app.run_webhook(listen="0.0.0.0", port=PORT, url_path=TOKEN, webhook_url=f"{WEBHOOK_URL}/{TOKEN}")
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
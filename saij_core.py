@@ -1,13 +1,15 @@
 # saij_core.py — Búsqueda PBA con ranking, parser NL y utilidades de comparación
-import os, re, hashlib, requests, pandas as pd
+import os, re, csv, glob, json, time, shutil, hashlib, datetime, logging, weakref, functools, threading, unicodedata, email.utils, requests, urllib3
+import numpy as np, pandas as pd, pyarrow as pa, pyarrow.compute as pc, pyarrow.csv as pacsv
+from collections import OrderedDict
 from typing import Optional, Dict, List, Tuple
-from rapidfuzz import fuzz
-from unidecode import unidecode
+from rapidfuzz import fuzz, process, utils as fuzz_utils
 
 PBA_PORTAL   = "https://catalogo.datos.gba.gob.ar"
 DATASET_SLUG = "base-saij-de-normativa-provincial"
 CACHE_DIR    = os.path.join(os.path.dirname(__file__), "_cache")
 os.makedirs(CACHE_DIR, exist_ok=True)
+log = logging.getLogger(__name__)
 
 CAND_COLS = {
     "provincia": ["provincia","jurisdiccion","jurisdicción"],
@@ -19,14 +21,49 @@ CAND_COLS = {
     "estado":    ["estado","vigencia","estado_vigencia"],
     "url":       ["url","enlace","link","href"]
 }
+_CACHE_VERSION = 15  # subir cuando cambien las columnas derivadas del sidecar
+_RERANK_K = 200      # candidatos del pase literal que pasan al puntaje aproximado
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# texto respaldado por Arrow: str.contains/str.count corren en los kernels C++ de
+# pyarrow (regex con RE2, autómata sin backtracking) y no en el `re` de Python
+_STR = pd.StringDtype("pyarrow")
+_EST_VIG    = "vigente|en vigor|activo"                 # estado que cuenta como vigente
+_EST_NO_VIG = "no vigente|derog|anulad|abrog|caduc"     # ... y como no vigente
+_RESULTS_MAX = 256   # búsquedas recordadas por base cargada
+_PKG_TTL = 3600      # segundos que se reusa la respuesta de package_show
+_PKG_MEMO: Dict[str, Tuple[float, Dict]] = {}
+_DF_CACHE: Dict = {"df": None, "t": 0.0}   # base compartida por el proceso (get_df)
+_DF_LOCK = threading.Lock()
+# estado por base cargada (índice invertido, resultados recientes); id(df) -> (ref al df, estado)
+_FRAMES: Dict[int, Tuple[weakref.ref, Dict]] = {}
 
 # -------- descarga/caché --------
-def _ckan_package_show() -> Dict:
+def _ckan_package_show(max_age: float = _PKG_TTL) -> Dict:
+    """Ficha del dataset en CKAN. Cambia a lo sumo una vez por día: se guarda en memoria y
+    en _cache/pkg_show.json (compartido entre procesos) y se reusa por `max_age` segundos."""
+    now = time.time(); hit = _PKG_MEMO.get("res")
+    if hit and now - hit[0] < max_age: return hit[1]
+    p = os.path.join(CACHE_DIR, "pkg_show.json")
+    try:
+        t = os.path.getmtime(p)
+        if now - t < max_age:
+            with open(p, encoding="utf-8") as f: res = json.load(f)
+            _PKG_MEMO["res"] = (t, res)
+            return res
+    except (OSError, ValueError):
+        pass
     r = requests.get(f"{PBA_PORTAL}/api/3/action/package_show", params={"id": DATASET_SLUG}, timeout=60)
     r.raise_for_status()
     j = r.json()
     if not j.get("success"): raise RuntimeError("CKAN package_show no exitoso")
-    return j["result"]
+    res = j["result"]
+    try:
+        with open(p + ".tmp", "w", encoding="utf-8") as f: json.dump(res, f, ensure_ascii=False)
+        os.replace(p + ".tmp", p)
+    except OSError as e:
+        log.warning("No se pudo guardar package_show en disco (%s)", e)
+    _PKG_MEMO["res"] = (now, res)
+    return res
 
 def _best_resource(resources) -> Optional[Dict]:
     prefer = ("CSV","XLSX","XLS")
@@ -41,144 +78,514 @@ def _best_resource(resources) -> Optional[Dict]:
 
 def _cache_path(url: str) -> str:
     ext = ".csv" if ".csv" in url.lower() else (".xlsx" if ".xlsx" in url.lower() else ".xls")
-    return os.path.join(CACHE_DIR, f"saij_pba_{hashlib.md5(url.encode()).hexdigest()}{ext}")
+    path = os.path.join(CACHE_DIR, f"saij_pba_{hashlib.blake2b(url.encode(), digest_size=8).hexdigest()}{ext}")
+    if os.path.exists(path) or os.path.exists(path + ".arrow"): return path
+    # cachés de versiones anteriores (nombre con md5): se siguen usando en lugar de bajar de nuevo
+    old = os.path.join(CACHE_DIR, f"saij_pba_{hashlib.md5(url.encode()).hexdigest()}{ext}")
+    return old if os.path.exists(old) or os.path.exists(old + ".arrow") else path
+
+def _stamp_time(stamp: str) -> Optional[float]:
+    # last_modified de CKAN: ISO 8601, en UTC si no trae huso
+    try:
+        t = datetime.datetime.fromisoformat(stamp)
+    except (TypeError, ValueError):
+        return None
+    return (t if t.tzinfo else t.replace(tzinfo=datetime.timezone.utc)).timestamp()
+
+def _read_meta(path: str) -> Dict:
+    try:
+        with open(path, encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _download(url: str, path: str, stamp: str = "", retries: int = 5,
+              cond: Optional[Dict] = None) -> Optional[Dict]:
+    """Descarga `url` a `path` pasando por un .part: si la conexión se corta, reintenta
+    pidiendo sólo lo que falta (Range) en lugar de bajar todo de nuevo.
+
+    Con `cond` (etag/http_modified de la descarga anterior) el pedido es condicional:
+    devuelve None si el servidor contesta 304 y el archivo en disco sigue vigente.
+    Si no, devuelve los validadores de la respuesta para la próxima vez."""
+    # el .part lleva la versión del recurso: nunca se continúa un archivo de otra versión
+    part = f"{path}.{hashlib.md5(stamp.encode()).hexdigest()[:8]}.part"
+    # los .part de versiones anteriores ya no se van a continuar: se borran
+    for old in glob.glob(glob.escape(path) + ".*.part"):
+        if old != part:
+            try: os.remove(old)
+            except OSError: pass
+    got: Dict = {}
+    for intento in range(retries):
+        done = os.path.getsize(part) if os.path.exists(part) else 0
+        # el rango se cuenta sobre el contenido sin comprimir, que es lo que quedó escrito
+        headers = {"Range": f"bytes={done}-", "Accept-Encoding": "identity"} if done else {}
+        if cond and not done:
+            if cond.get("etag"): headers["If-None-Match"] = cond["etag"]
+            if cond.get("http_modified"): headers["If-Modified-Since"] = cond["http_modified"]
+        try:
+            with requests.get(url, stream=True, timeout=300, headers=headers) as r:
+                if r.status_code == 304: return None
+                if done and r.status_code == 416: break   # el .part ya estaba completo
+                r.raise_for_status()
+                got = {"etag": r.headers.get("ETag"), "http_modified": r.headers.get("Last-Modified")}
+                # copia en bloques de 1 MiB sin bucle Python; urllib3 descomprime si vino gzip
+                r.raw.decode_content = True
+                with open(part, "ab" if done and r.status_code == 206 else "wb") as f:
+                    shutil.copyfileobj(r.raw, f, 1<<20)
+            break
+        # leyendo r.raw los cortes llegan como errores de urllib3, no de requests
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            if intento == retries - 1: raise
+            log.warning("Descarga interrumpida (%s); reintento %d/%d", e, intento + 1, retries - 1)
+            time.sleep(2 ** intento)
+    os.replace(part, path)
+    return got
+
+def _write_meta(path: str, stamp: str, cols: Dict, http: Dict) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": _CACHE_VERSION, "last_modified": stamp, "cols": cols, **http}, f, ensure_ascii=False)
+
+def _write_arrow(path: str, tbl: pa.Table) -> None:
+    try:
+        with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, tbl.schema) as w:
+            w.write_table(tbl)
+        os.replace(path + ".tmp", path)
+    except BaseException:
+        # sin .tmp a medio escribir (puede pesar tanto como la base) ocupando el disco
+        if os.path.exists(path + ".tmp"): os.remove(path + ".tmp")
+        raise
+
+def _read_arrow(path: str) -> pa.Table:
+    # Arrow IPC sin comprimir y mapeado en memoria: lectura sin copia, y los
+    # procesos que abren el mismo archivo comparten las páginas del sistema
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+def _arrow_types(t: pa.DataType):
+    return _STR if pa.types.is_string(t) or pa.types.is_large_string(t) else None
+
+def _read_csv(path: str) -> pd.DataFrame:
+    # lector CSV de pyarrow (C++, por bloques y con hilos): las celdas quedan en buffers
+    # Arrow en lugar de un objeto str de Python por celda. Todas las columnas se leen
+    # como texto, igual que dtype=str: sin inferir tipos que cambien "007" o las fechas
+    enc = "utf8"
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as f: header = next(csv.reader(f), [])
+    except UnicodeDecodeError:   # no es UTF-8: Latin-1 (acepta cualquier byte)
+        enc = "latin-1"
+        with open(path, encoding=enc, newline="") as f: header = next(csv.reader(f), [])
+    try:
+        tbl = pacsv.read_csv(path,
+            read_options=pacsv.ReadOptions(block_size=8 << 20, encoding=enc),
+            parse_options=pacsv.ParseOptions(newlines_in_values=True),
+            convert_options=pacsv.ConvertOptions(column_types={c: pa.string() for c in header},
+                                                 strings_can_be_null=True))
+    except pa.ArrowInvalid as e:   # encabezado repetido, filas irregulares, bytes no UTF-8 más abajo
+        log.warning("pyarrow no pudo leer el CSV (%s); se usa pandas", e)
+        try:
+            return pd.read_csv(path, dtype=str, low_memory=False, encoding=enc)
+        except UnicodeDecodeError:
+            return pd.read_csv(path, dtype=str, low_memory=False, encoding="latin-1")
+    return tbl.to_pandas(types_mapper=_arrow_types)
+
+def _read_source(path: str) -> pd.DataFrame:
+    if path.lower().endswith(".csv"): return _read_csv(path)
+    # calamine (Rust) lee XLSX/XLS en streaming; openpyxl arma todo el XML en memoria
+    try:
+        return pd.read_excel(path, dtype=str, engine="calamine")
+    except (ImportError, ValueError):   # sin python-calamine, o pandas sin ese motor
+        return pd.read_excel(path, dtype=str)
+
+def _prepare(df: pd.DataFrame) -> Tuple[pd.DataFrame, Optional[Dict]]:
+    """Armado de la caché, una vez por versión del recurso: columnas limpias, sólo PBA,
+    columnas derivadas e índice invertido. Todo queda guardado en los sidecars Arrow."""
+    # nombres limpios y en minúsculas: _pick_col resuelve casi siempre por búsqueda exacta
+    names = df.columns.astype(str).str.strip(); low = names.str.lower()
+    df.columns = low if low.is_unique else names
+    df = df.fillna("").astype(_STR)
+    cols = _resolve_cols(df)
+    # sólo normas de PBA: se recorta una vez acá y la caché ya queda filtrada
+    m = _pba_mask(df)
+    if m is not None and not m.all(): df = df[m].reset_index(drop=True)
+    df.attrs["pba"] = True
+    # sumario normalizado una sola vez (lo usa el ranking en cada consulta)
+    if cols["sumario"]: df["_sum_norm"] = df[cols["sumario"]].str.lower().str.translate(_ACCENTS).astype(_STR)
+    # año numérico y vigencia como entero: los filtros de search pasan a ser comparaciones numpy
+    if cols["anio"]: df["_anio_int"] = _year_of(df[cols["anio"]])
+    if cols["estado"]: df["_estado_vig"] = _vig_state(df[cols["estado"]])
+    # fecha ya interpretada (datetime64): ordenar por fecha no vuelve a parsear texto
+    if cols["fecha"]: df["_fecha_dt"] = _dates_of(df[cols["fecha"]])
+    # tipo y número en minúsculas: los filtros buscan literal (regex=False) sin case=False
+    for k in ("tipo", "numero"):
+        if cols[k]: df["_lc_" + k] = df[cols[k]].str.lower()
+    # pocas categorías repetidas en muchas filas: códigos enteros + diccionario chico;
+    # str.contains sobre una categórica evalúa cada valor distinto una sola vez
+    for k in ("provincia", "tipo", "estado", "anio"):
+        c = cols[k]
+        if c and df[c].nunique() <= len(df) // 2:
+            for n in (c, "_lc_" + k):
+                if n in df.columns: df[n] = df[n].astype("category")
+    return df, (_build_index(df["_sum_norm"]) if cols["sumario"] else None)
 
 def load_latest_dataframe() -> pd.DataFrame:
     res = _best_resource(_ckan_package_show().get("resources", []))
     if not res: raise RuntimeError("No se encontró recurso descargable")
     url = res["url"]; path = _cache_path(url)
-    if not os.path.exists(path):
-        with requests.get(url, stream=True, timeout=300) as r:
-            r.raise_for_status()
-            with open(path, "wb") as f:
-                for ch in r.iter_content(1<<20):
-                    if ch: f.write(ch)
-    if path.lower().endswith(".csv"):
-        df = pd.read_csv(path, dtype=str, low_memory=False)
-    else:
-        df = pd.read_excel(path, dtype=str)
-    df.columns = [c.strip() for c in df.columns]
+    stamp = res.get("last_modified") or res.get("created") or ""
+    arrow, idx_path, meta_path = path + ".arrow", path + ".idx.arrow", path + ".meta.json"
+    meta = _read_meta(meta_path)
+    built = os.path.exists(arrow) and meta.get("version") == _CACHE_VERSION
+    http = {k: meta.get(k) for k in ("etag", "http_modified")}
+    if not meta and os.path.exists(path):
+        # archivo bajado por una versión sin meta.json: si es posterior al último cambio que
+        # informa CKAN se adopta tal cual; si no, se revalida con su fecha (If-Modified-Since)
+        mt = os.path.getmtime(path); st = _stamp_time(stamp)
+        if st is not None and mt >= st: meta = {"last_modified": stamp}
+        else: http["http_modified"] = email.utils.formatdate(mt, usegmt=True)
+    # otra versión según CKAN (o sin archivo): se pide de nuevo, condicional si ya hay uno.
+    # Si el servidor dice que no cambió (304) se sigue usando lo que hay en disco
+    if meta.get("last_modified") != stamp or not (built or os.path.exists(path)):
+        try:
+            got = _download(url, path, stamp, cond=http if os.path.exists(path) else None)
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            if not (built or os.path.exists(path)): raise
+            # sin conexión con el servidor del recurso: se sigue con la versión que hay en
+            # disco, anotada con su sello viejo para reintentar en la próxima carga
+            log.warning("No se pudo bajar la versión nueva (%s); se usa la caché anterior", e)
+            stamp = meta.get("last_modified") or ""
+        else:
+            if got is not None: http, built = got, False
+            elif built: _write_meta(meta_path, stamp, meta.get("cols", {}), http)
+    # sidecar columnar vigente para esta versión del recurso: sin parsear CSV/XLSX
+    if built:
+        # split_blocks: cada columna numérica queda como vista sobre el archivo mapeado (sin
+        # consolidar en un bloque nuevo); el texto ya se envuelve sin copia
+        df = _read_arrow(arrow).to_pandas(types_mapper=_arrow_types, split_blocks=True)
+        df.attrs["cols"] = meta.get("cols", {}); df.attrs["pba"] = True
+        _register(df, _index_from_table(_read_arrow(idx_path)) if os.path.exists(idx_path) else None)
+        return df
+    df, ix = _prepare(_read_source(path))
+    try:
+        _write_arrow(arrow, pa.Table.from_pandas(df, preserve_index=False))
+        if ix is not None: _write_arrow(idx_path, _index_table(ix))
+        _write_meta(meta_path, stamp, df.attrs["cols"], http)
+    except Exception as e:
+        log.warning("No se pudo guardar la caché Arrow (%s); se usará el CSV/XLSX", e)
+    _register(df, ix)
     return df
 
+def get_df(max_age: float = 86400) -> pd.DataFrame:
+    """Base cargada una sola vez por proceso; se vuelve a cargar si tiene más de `max_age`
+    segundos (0 fuerza la recarga). Quien la esté usando conserva su objeto anterior."""
+    with _DF_LOCK:   # una sola carga aunque pidan varios hilos a la vez
+        if _DF_CACHE["df"] is None or time.time() - _DF_CACHE["t"] >= max_age:
+            _DF_CACHE["df"] = load_latest_dataframe(); _DF_CACHE["t"] = time.time()
+        return _DF_CACHE["df"]
+
+# -------- índice invertido sobre el sumario normalizado --------
+def _build_index(norm: pd.Series) -> Dict:
+    """token -> filas del df, en formato CSR: vocabulario ordenado, offsets y filas int32."""
+    tok = norm.reset_index(drop=True).str.findall(_TOKEN_RE.pattern).explode().dropna()
+    pairs = pd.DataFrame({"t": tok.to_numpy(), "r": tok.index.to_numpy(dtype=np.int32)}).drop_duplicates()
+    codes, vocab = pd.factorize(pairs["t"], sort=True)
+    order = np.lexsort((pairs["r"].to_numpy(), codes))
+    offs = np.zeros(len(vocab) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(codes, minlength=len(vocab)), out=offs[1:])
+    return {"vocab": list(vocab), "tok": pa.array(vocab, pa.string()), "offs": offs,
+            "rows": pairs["r"].to_numpy(dtype=np.int32)[order], "memo": {}}
+
+def _index_table(ix: Dict) -> pa.Table:
+    rows = pa.ListArray.from_arrays(pa.array(ix["offs"]), pa.array(ix["rows"]))
+    return pa.table({"token": ix["tok"], "rows": rows})
+
+def _index_from_table(tbl: pa.Table) -> Dict:
+    # offsets y filas quedan como vistas numpy sobre el archivo mapeado
+    lst = tbl.column("rows").combine_chunks(); tok = tbl.column("token").combine_chunks()
+    return {"vocab": tok.to_pylist(), "tok": tok, "offs": lst.offsets.to_numpy(),
+            "rows": lst.values.to_numpy(), "memo": {}}
+
+def _register(df: pd.DataFrame, ix: Optional[Dict]) -> None:
+    for k in [k for k, (ref, _) in _FRAMES.items() if ref() is None]: del _FRAMES[k]
+    _FRAMES[id(df)] = (weakref.ref(df), {"index": ix, "results": OrderedDict(), "lock": threading.Lock()})
+
+def _state_of(df: pd.DataFrame) -> Optional[Dict]:
+    # sólo vale para el mismo objeto: un recorte del df tiene otras posiciones
+    ent = _FRAMES.get(id(df))
+    return ent[1] if ent and ent[0]() is df else None
+
+def _index_of(df: pd.DataFrame) -> Optional[Dict]:
+    st = _state_of(df)
+    return st["index"] if st else None
+
+def _postings(ix: Dict, i: int) -> np.ndarray:
+    return ix["rows"][ix["offs"][i]:ix["offs"][i+1]]
+
+def _term_rows(ix: Dict, term: str) -> Optional[np.ndarray]:
+    """Filas cuyo sumario contiene `term` como subcadena (None si el índice no alcanza)."""
+    if not _TOKEN_RE.fullmatch(term): return None
+    memo = ix["memo"]; rows = memo.get(term)   # sin releer memo: search corre en varios hilos
+    if rows is None:
+        if len(memo) > 4096: memo.clear()
+        # tokens que contienen el término: un kernel Arrow sobre el vocabulario, sin bucle Python
+        ids = np.flatnonzero(pc.match_substring(ix["tok"], term).to_numpy(zero_copy_only=False))
+        if len(ids) == 1: rows = _postings(ix, ids[0])   # caso típico: una palabra exacta, ya ordenada
+        else: rows = np.unique(np.concatenate([_postings(ix, i) for i in ids])) if len(ids) else np.empty(0, dtype=np.int32)
+        memo[term] = rows
+    return rows
+
+def _similar_rows(ix: Dict, terms: List[str]) -> np.ndarray:
+    # "quisiste decir": hasta 10 tokens del vocabulario parecidos a cada término; todos los
+    # términos contra todo el vocabulario en una sola llamada C (con hilos)
+    sim = process.cdist(terms, ix["vocab"], scorer=fuzz.ratio, score_cutoff=80, workers=-1)
+    hits = [_postings(ix, i) for row in sim for i in _topk(row, 10) if row[i]]
+    return np.unique(np.concatenate(hits)) if hits else np.empty(0, dtype=np.int32)
+
+def _candidates(ix: Dict, terms: List[str]) -> Optional[np.ndarray]:
+    """Filas con alguna coincidencia literal (o, si no hay, aproximada por vocabulario)."""
+    per = [_term_rows(ix, t) for t in terms]
+    if not per or any(p is None for p in per): return None
+    hits = np.unique(np.concatenate(per))
+    return hits if len(hits) else _similar_rows(ix, terms)
+
 # -------- helpers de columnas/normalización --------
 def _pick_col(df: pd.DataFrame, keys: List[str]) -> Optional[str]:
-    cols = list(df.columns); low = [c.lower() for c in cols]
+    low: Dict[str, str] = {}
+    for c in df.columns: low.setdefault(str(c).lower(), c)
     for k in keys:
-        if k.lower() in low: return cols[low.index(k.lower())]
-    for i,c in enumerate(low):
-        if any(k.lower() in c for k in keys): return cols[i]
+        if k.lower() in low: return low[k.lower()]
+    for lc, c in low.items():
+        if any(k.lower() in lc for k in keys): return c
     return None
 
-def _filter_pba(df: pd.DataFrame) -> pd.DataFrame:
-    c = _pick_col(df, CAND_COLS["provincia"])
-    if c and c in df.columns:
-        return df[df[c].fillna("").str.contains("Buenos Aires", case=False, na=False)].copy()
-    return df.copy()
+def _resolve_cols(df: pd.DataFrame) -> Dict[str, Optional[str]]:
+    """Columna real para cada clave de CAND_COLS; se resuelve una vez y queda en df.attrs
+    (load_latest_dataframe ya la deja resuelta, también al leer la caché)."""
+    cols = df.attrs.get("cols")
+    if not cols or any(c and c not in df.columns for c in cols.values()):
+        cols = df.attrs["cols"] = {k: _pick_col(df, v) for k, v in CAND_COLS.items()}
+    return cols
+
+def _year_of(s: pd.Series) -> np.ndarray:
+    # primer grupo de 4 dígitos; 0 si no hay (igual que el filtro por rango original)
+    y = pd.to_numeric(s.str.extract(r"(\d{4})", expand=False), errors="coerce")
+    return y.fillna(0).to_numpy(dtype=np.int16)
+
+_DATE_FMTS = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%Y-%m-%dT%H:%M:%S",
+              "%Y-%m-%dT%H:%M:%S%z",   # ISO con huso (Z, -03:00)
+              "%Y-%m-%d %H:%M:%S")   # así salen de read_excel(dtype=str) las celdas de fecha
+
+def _dates_of(s: pd.Series) -> pd.Series:
+    # con un formato fijo pandas parsea en C; si ninguno cubre casi toda la muestra,
+    # "mixed" (día primero) resuelve celda por celda. Lo que no es fecha queda NaT
+    # utc=True: con husos horarios (aunque se mezclen) todo pasa a UTC y después se deja
+    # naive, así _fecha_dt es siempre datetime64 sin zona. Si igual falla, todo NaT
+    s = s.astype(_STR); sample = s[s != ""].head(200)
+    try:
+        for fmt in _DATE_FMTS:
+            if len(sample) and pd.to_datetime(sample, format=fmt, errors="coerce", utc=True).notna().mean() >= 0.9:
+                return pd.to_datetime(s, format=fmt, errors="coerce", utc=True).dt.tz_localize(None)
+        return pd.to_datetime(s, format="mixed", dayfirst=True, errors="coerce", utc=True).dt.tz_localize(None)
+    except (ValueError, TypeError, OverflowError) as e:
+        log.warning("No se pudo interpretar la columna de fechas (%s); queda sin fechas", e)
+        return pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+
+def _has(s: pd.Series, pat: str, regex: bool = True, ignore_case: bool = True) -> np.ndarray:
+    """Máscara numpy de las filas que contienen `pat`, con los kernels de pyarrow sobre el
+    buffer UTF-8 (sin pasar por str.contains). regex=False: subcadena literal."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # se evalúa cada categoría una vez y se reparte por código (-1, nulo, queda en False)
+        hit = _has(pd.Series(s.cat.categories), pat, regex, ignore_case)
+        return np.append(hit, False)[s.cat.codes.to_numpy()]
+    f = pc.match_substring_regex if regex else pc.match_substring
+    # nulos (sólo en un df ajeno: la carga ya los deja en "") cuentan como sin coincidencia
+    return f(pa.array(s.astype(_STR)), pat, ignore_case=ignore_case).fill_null(False).to_numpy(zero_copy_only=False)
+
+def _rows_of(s: pd.Series, rows: Optional[np.ndarray]) -> pd.Series:
+    return s if rows is None or len(rows) == len(s) else s.iloc[rows]
+
+def _lit(df: pd.DataFrame, key: str, c: str, text: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+    # subcadena literal sin distinguir mayúsculas, sobre _lc_<key> si la caché lo trae;
+    # con `rows`, sólo se miran esas filas (y la máscara es sobre ellas)
+    lc = "_lc_" + key
+    if lc in df.columns: return _has(_rows_of(df[lc], rows), text.lower(), regex=False, ignore_case=False)
+    return _has(_rows_of(df[c], rows), text, regex=False)
+
+def _vig_state(s: pd.Series) -> np.ndarray:
+    # 1 vigente, -1 no vigente, 0 sin dato; "no vigente" gana aunque contenga "vigente"
+    no = _has(s, _EST_NO_VIG)
+    return np.where(no, -1, _has(s, _EST_VIG).astype(np.int8)).astype(np.int8)
+
+def _pba_mask(df: pd.DataFrame) -> Optional[np.ndarray]:
+    c = _resolve_cols(df).get("provincia")
+    return _has(df[c], "Buenos Aires", regex=False) if c else None
+
+# minúsculas sin tildes: tabla para str.translate (C), sin pasar por unidecode. Se arma
+# una vez con NFKD sobre los alfabetos latinos (á->a, ñ->n, º->o, ...); las marcas
+# combinantes sueltas (texto ya descompuesto) se borran
+_ACCENTS = {cp: a for cp in (0xAA, 0xBA, *range(0xC0, 0x250))
+            if (a := unicodedata.normalize("NFKD", chr(cp)).encode("ascii", "ignore").decode())}
+_ACCENTS.update(dict.fromkeys(range(0x300, 0x370)))
 
 def _norm(s: str) -> str:
-    return unidecode((s or "").lower())
+    return (s or "").lower().translate(_ACCENTS)
 
 # -------- Parser de español (intención y filtros) --------
 _TIPO_ALIASES = {"ley":"LEY","decreto":"DECRETO","resolucion":"RESOLUCIÓN","resolución":"RESOLUCIÓN","res.":"RESOLUCIÓN","decr.":"DECRETO"}
 
+# patrones compilados una vez (parse_nl_query corre en cada mensaje)
+_RE_COMPARE = re.compile(r"\bcompar", re.I)
+_RE_NORMA   = re.compile(r"(ley|decreto|resoluci[oó]n)\s+(\d+)(?:/\s*(\d{4}))?", re.I)
+_RE_TIPOS   = [(re.compile(rf"\b{k}\b", re.I), v) for k, v in _TIPO_ALIASES.items()]
+_RE_VIG     = re.compile(r"\b(vigente|vigentes|en vigor|activo)\b", re.I)
+_RE_NO_VIG  = re.compile(r"\b(derogad|no vigente|anulad|abrogad|caduc)\b", re.I)
+_RE_DESDE   = re.compile(r"desde\s+(\d{4})", re.I)
+_RE_HASTA   = re.compile(r"hasta\s+(\d{4})", re.I)
+_RE_RANGO   = re.compile(r"(\d{4})\s*(?:a|hasta|-|al)\s*(\d{4})", re.I)
+_RE_ANIO    = re.compile(r"(?:año|anio)\s*(\d{4})", re.I)
+_RE_LIMIT   = re.compile(r"(?:limit|límite|limite)\s*[: ]\s*(\d{1,2})", re.I)
+# todo lo reconocido, en una sola alternación para quitarlo de "q" de una pasada
+_RE_STRIP   = re.compile("|".join([
+    r"(?:ley|decreto|resoluci[oó]n)\s+\d+(?:/\d{4})?",
+    r"(?:desde|hasta)\s+\d{4}",
+    r"\b\d{4}\s*(?:a|hasta|-|al)\s*\d{4}\b",
+    r"(?:vigente|vigentes|derogad|no vigente|anulad|abrogad|caduc)",
+    r"(?:limit|l[ií]mite|limite)\s*[: ]\s*\d{1,2}",
+]), re.I)
+
 def parse_nl_query(text: str) -> Dict:
-    raw = (text or "").strip()
+    return dict(_parse_nl_query((text or "").strip()))   # copia: quien llama puede modificarla
+
+@functools.lru_cache(maxsize=4096)
+def _parse_nl_query(raw: str) -> Tuple:
     out = {"q": None, "tipo": None, "numero": None, "anio": None, "anio_desde": None, "anio_hasta": None, "vigente": None, "limit": None, "action": "search"}
 
     # intención comparar
-    if re.search(r"\bcompar", raw, re.I):
+    if _RE_COMPARE.search(raw):
         out["action"] = "compare"
 
     # "ley 14528", "decreto 2366/2025"
-    m = re.search(r"(ley|decreto|resoluci[oó]n)\s+(\d+)(?:/\s*(\d{4}))?", raw, flags=re.I)
+    m = _RE_NORMA.search(raw)
     if m:
         out["tipo"] = _TIPO_ALIASES.get(m.group(1).lower(), m.group(1).upper())
         out["numero"] = m.group(2)
         if m.group(3): out["anio"] = m.group(3)
 
     # tipo suelto
-    for k,v in _TIPO_ALIASES.items():
-        if re.search(rf"\b{k}\b", raw, re.I): out["tipo"] = v
+    for rx, v in _RE_TIPOS:
+        if rx.search(raw): out["tipo"] = v
 
     # vigencia
-    if re.search(r"\b(vigente|vigentes|en vigor|activo)\b", raw, re.I): out["vigente"]=True
-    if re.search(r"\b(derogad|no vigente|anulad|abrogad|caduc)\b", raw, re.I): out["vigente"]=False
+    if _RE_VIG.search(raw): out["vigente"]=True
+    if _RE_NO_VIG.search(raw): out["vigente"]=False
 
     # años/rangos
-    md = re.search(r"desde\s+(\d{4})", raw, re.I)
-    mh = re.search(r"hasta\s+(\d{4})", raw, re.I)
-    mr = re.search(r"(\d{4})\s*(?:a|hasta|-|al)\s*(\d{4})", raw, re.I)
+    md = _RE_DESDE.search(raw)
+    mh = _RE_HASTA.search(raw)
+    mr = _RE_RANGO.search(raw)
     if md: out["anio_desde"] = md.group(1)
     if mh: out["anio_hasta"] = mh.group(1)
     if mr: out["anio_desde"], out["anio_hasta"] = mr.group(1), mr.group(2)
-    ma = re.search(r"(?:año|anio)\s*(\d{4})", raw, re.I)
+    ma = _RE_ANIO.search(raw)
     if ma: out["anio"] = ma.group(1)
 
-    ml = re.search(r"(?:limit|límite|limite)\s*[: ]\s*(\d{1,2})", raw, re.I)
+    ml = _RE_LIMIT.search(raw)
     if ml: out["limit"] = int(ml.group(1))
 
     # quitar lo reconocido para "q"
-    q = re.sub(r"(ley|decreto|resoluci[oó]n)\s+\d+(?:/\d{4})?", " ", raw, flags=re.I)
-    q = re.sub(r"(desde|hasta)\s+\d{4}", " ", q, flags=re.I)
-    q = re.sub(r"\b\d{4}\s*(?:a|hasta|-|al)\s*\d{4}\b", " ", q, flags=re.I)
-    q = re.sub(r"(vigente|vigentes|derogad|no vigente|anulad|abrogad|caduc)", " ", q, flags=re.I)
-    q = re.sub(r"(limit|l[ií]mite|limite)\s*[: ]\s*\d{1,2}", " ", q, flags=re.I)
-    q = " ".join(q.split())
+    q = " ".join(_RE_STRIP.sub(" ", raw).split())
     out["q"] = q or None
-    return out
+    return tuple(out.items())
 
 # -------- ranking y búsqueda --------
-def _rank_score(text: str, terms: List[str]) -> float:
-    t = _norm(text); score = 0.0
-    for term in terms:
-        if not term: continue
-        tt = _norm(term)
-        score += 2.0 * t.count(tt)           # literal
-        score += 0.02 * fuzz.partial_ratio(t, tt)  # aproximado
-    return score
-
-def search(df: pd.DataFrame,
+def _topk(score: np.ndarray, k: Optional[int]) -> np.ndarray:
+    """Índices de los k mayores puntajes, de mayor a menor y con empates por posición
+    (lo mismo que un argsort estable, pero sin ordenar todo el arreglo)."""
+    if k and k < len(score):
+        kth = np.partition(score, len(score) - k)[len(score) - k]
+        idx = np.flatnonzero(score > kth)
+        idx = np.concatenate([idx, np.flatnonzero(score == kth)[:k - len(idx)]])
+    else:
+        idx = np.arange(len(score))
+    return idx[np.lexsort((idx, -score[idx]))]
+
+def _rank(norm: pd.Series, terms: List[str], cand: Optional[np.ndarray]=None,
+          limit: Optional[int]=None) -> np.ndarray:
+    """Posiciones de `norm` (o de `cand`, si se da) ordenadas por relevancia: pase literal
+    vectorizado y re-ranking aproximado sólo sobre los mejores candidatos. Con `limit`
+    sólo se devuelven (y ordenan) las primeras."""
+    pos = np.arange(len(norm)) if cand is None else cand
+    sub = norm if cand is None else norm.iloc[cand]
+    # el sumario ya es un buffer UTF-8 contiguo + offsets (Arrow): el conteo literal
+    # de cada término corre en C++ sobre ese buffer, sin regex ni objetos por fila
+    arr = pa.array(sub, from_pandas=True); lit = np.zeros(len(sub))
+    for t in terms:
+        lit += 2.0 * pc.count_substring(arr, t).fill_null(0).to_numpy(zero_copy_only=False)   # literal
+    sel = np.flatnonzero(lit > 0)
+    if len(sel): sel = sel[_topk(lit[sel], _RERANK_K)]
+    else: sel = np.arange(len(sub))   # sin coincidencias literales: sólo queda el aproximado
+    # una sola llamada C (con hilos) en lugar de un partial_ratio por fila y término
+    fz = process.cdist(terms, sub.iloc[sel].to_numpy(dtype=object), scorer=fuzz.partial_ratio,
+                       dtype=np.float64, workers=-1).sum(axis=0) if terms else np.zeros(len(sel))
+    score = lit[sel] + 0.02 * fz   # aproximado
+    return pos[sel[_topk(score, limit)]]
+
+def search(df: Optional[pd.DataFrame]=None,
            query: Optional[str]=None, tipo: Optional[str]=None,
            vigente: Optional[bool]=None, numero: Optional[str]=None,
            anio: Optional[str]=None, anio_desde: Optional[str]=None,
            anio_hasta: Optional[str]=None, limit: int=10) -> Tuple[pd.DataFrame, Dict[str,str]]:
-    out = _filter_pba(df)
-    c_sum = _pick_col(out, CAND_COLS["sumario"])
-    c_tip = _pick_col(out, CAND_COLS["tipo"])
-    c_est = _pick_col(out, CAND_COLS["estado"])
-    c_num = _pick_col(out, CAND_COLS["numero"])
-    c_an  = _pick_col(out, CAND_COLS["anio"])
-    c_fe  = _pick_col(out, CAND_COLS["fecha"])
-    c_url = _pick_col(out, CAND_COLS["url"])
-
-    if tipo and c_tip: out = out[out[c_tip].fillna("").str.contains(tipo, case=False, na=False)]
-    if numero and c_num: out = out[out[c_num].fillna("").str.contains(re.escape(str(numero)), case=False, na=False)]
-    if anio and c_an:
-        out = out[out[c_an].fillna("").str.contains(str(anio), case=False, na=False)]
-    else:
-        if (anio_desde or anio_hasta) and c_an:
-            lo = int(anio_desde or "1800"); hi = int(anio_hasta or "9999")
-            ext = out[c_an].fillna("").str.extract(r"(\d{4})", expand=False).fillna("0").astype(int)
-            out = out[ext.between(lo, hi, inclusive="both")]
+    if df is None: df = get_df()   # sin base explícita, la compartida del proceso
+    # consultas repetidas: se guardan las filas (no el recorte) y se rearma el resultado
+    st = _state_of(df)
+    key = (" ".join(_norm(w) for w in query.split()) if query else None, (tipo or "").lower(), vigente,
+           str(numero or ""), str(anio or ""), str(anio_desde or ""), str(anio_hasta or ""), int(limit or 0))
+    if st is not None:
+        with st["lock"]:
+            hit = st["results"].get(key)
+            if hit is not None: st["results"].move_to_end(key)
+        if hit is not None: return df.take(hit[0]), dict(hit[1])
+    out, cols = _search(df, query, tipo, vigente, numero, anio, anio_desde, anio_hasta, limit)
+    if st is not None:
+        with st["lock"]:
+            st["results"][key] = (out.index.to_numpy(), cols)
+            if len(st["results"]) > _RESULTS_MAX: st["results"].popitem(last=False)
+    return out, cols
+
+def _search(df, query, tipo, vigente, numero, anio, anio_desde, anio_hasta, limit):
+    c = _resolve_cols(df)
+    c_sum, c_tip, c_est, c_num = c["sumario"], c["tipo"], c["estado"], c["numero"]
+    c_an, c_fe, c_url = c["anio"], c["fecha"], c["url"]
 
+    # primero los filtros numéricos (comparaciones numpy sobre toda la base, baratas)
+    m = None if df.attrs.get("pba") else _pba_mask(df)   # la base cargada ya es sólo PBA
+    if m is None: m = np.ones(len(df), dtype=bool)
+    if not anio and (anio_desde or anio_hasta) and c_an:
+        lo = int(anio_desde or "1800"); hi = int(anio_hasta or "9999")
+        y = df["_anio_int"].to_numpy() if "_anio_int" in df.columns else _year_of(df[c_an])
+        m &= (y >= lo) & (y <= hi)
     if vigente is not None and c_est:
-        if vigente:
-            mask = out[c_est].fillna("").str.contains("vigente|en vigor|activo", case=False, na=False)
-        else:
-            mask = out[c_est].fillna("").str.contains("no vigente|derog|anulad|abrog|caduc", case=False, na=False)
-        out = out[mask]
+        v = df["_estado_vig"].to_numpy() if "_estado_vig" in df.columns else _vig_state(df[c_est])
+        m &= v == (1 if vigente else -1)
+    rows = np.flatnonzero(m)
+    # después los de texto, del más selectivo al menos y sólo sobre las filas que quedan
+    if numero and c_num: rows = rows[_lit(df, "numero", c_num, str(numero), rows)]
+    if anio and c_an: rows = rows[_has(_rows_of(df[c_an], rows), str(anio), regex=False)]
+    if tipo and c_tip: rows = rows[_lit(df, "tipo", c_tip, tipo, rows)]
+    if len(rows) < m.sum(): m = np.zeros(len(df), dtype=bool); m[rows] = True
+    out = df.iloc[rows]
 
     if c_sum and query:
-        terms = [t for t in (query or "").split() if t.strip()]
-        out = out.copy()
-        out["_score"] = out[c_sum].fillna("").apply(lambda s: _rank_score(str(s), terms))
-        out = out.sort_values("_score", ascending=False).drop(columns=["_score"])
+        terms = [t for t in (_norm(w) for w in query.split()) if t]
+        norm = out["_sum_norm"] if "_sum_norm" in out.columns else out[c_sum].fillna("").str.lower().str.translate(_ACCENTS)
+        ix = _index_of(df); cand = None
+        hits = _candidates(ix, terms) if ix is not None else None
+        if hits is not None and len(hits):
+            cand = np.searchsorted(rows, hits[m[hits]])   # posiciones en `out` de los que pasan los filtros
+            if not len(cand): cand = None   # ninguna sobrevive a los filtros: barrido completo
+        out = out.iloc[_rank(norm, terms, cand, int(limit) if limit else None)]
     elif c_fe:
-        try:
-            out["_f"] = pd.to_datetime(out[c_fe], errors="coerce", dayfirst=True)
-            out = out.sort_values("_f", ascending=False).drop(columns=["_f"])
-        except Exception:
-            pass
+        f = (out["_fecha_dt"] if "_fecha_dt" in out.columns else _dates_of(out[c_fe])).to_numpy()
+        # las `limit` más recientes sin ordenar todo; NaT (sin fecha) va al final
+        key = np.where(np.isnat(f), np.iinfo(np.int64).min + 1, f.view("i8"))
+        out = out.iloc[_topk(key, int(limit) if limit else None)]
 
     if limit: out = out.head(int(limit))
     cols = {"sumario":c_sum,"tipo":c_tip,"estado":c_est,"numero":c_num,"anio":c_an,"fecha":c_fe,"url":c_url}
@@ -193,15 +600,16 @@ def summarize_row(row: pd.Series, cols: Dict[str,str]) -> str:
     s = str(row.get(cols.get("sumario",""),""))
     return ("; ".join(t) + "\n" + s).strip()
 
+_RE_KEYWORD = re.compile(r"[A-Za-zÁÉÍÓÚáéíóúñÑ]{4,}")
+_STOP = frozenset("sobre para como ante entre hacia desde hasta fuera dentro este esta estaos estas".split())
+
 def compare_rows(a: pd.Series, b: pd.Series, cols: Dict[str,str]) -> str:
     sa, sb = summarize_row(a, cols), summarize_row(b, cols)
-    # similitud general
-    sim = fuzz.token_set_ratio(sa, sb)
+    # similitud general (la normalización la hace rapidfuzz en C)
+    sim = fuzz.token_set_ratio(sa, sb, processor=fuzz_utils.default_process)
     # palabras clave distintas (muy simple, sirve para orientar)
     def keys(s): 
-        toks = re.findall(r"[A-Za-zÁÉÍÓÚáéíóúñÑ]{4,}", _norm(s))
-        stop = set("sobre para como ante entre hacia desde hasta fuera dentro este esta estaos estas".split())
-        return set([w for w in toks if w not in stop])
+        return set(_RE_KEYWORD.findall(_norm(s))) - _STOP
     ka, kb = keys(sa), keys(sb)
     only_a = ", ".join(sorted(list(ka-kb))[:10])
     only_b = ", ".join(sorted(list(kb-ka))[:10])